@@ -1,35 +1,76 @@
 """
 CRUD operations for database
 """
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only, selectinload, undefer
 from sqlalchemy.exc import SQLAlchemyError, OperationalError
-from app import models, schemas
-from app.database import Base, engine
+from app import database, events, models, schemas
+from app.database import Base
+from app.log import get_logger
+from app.user_index import user_index
+
+logger = get_logger(__name__)
 
 
 def ensure_tables_exist():
     """Create tables if they don't exist"""
     try:
-        Base.metadata.create_all(bind=engine)
+        for shard_engine in database.get_shard_engines():
+            Base.metadata.create_all(bind=shard_engine)
     except Exception as e:
-        print(f"⚠ Could not create tables: {str(e)[:50]}")
+        logger.warning("Could not create tables: %s", str(e)[:50])
+
+
+def _column_options(model: type[Base], fields: list[str] | None) -> list:
+    """Load only the selected columns, or every column including deferred ones"""
+    if fields is None:
+        return [undefer("*")]
+    return [load_only(*(getattr(model, field) for field in fields))]
+
+
+def _paginate(query, model: type[Base], skip: int, limit: int, after_id: int | None) -> list:
+    """
+    Page through rows in id order, after `after_id` (keyset) and/or `skip` rows.
+    Sharded queries run on every shard; each returns its first skip + limit
+    rows and the per-shard runs are merged by id.
+    """
+    if after_id is not None:
+        query = query.filter(model.id > after_id)
+    query = query.order_by(model.id)
+    if database.shard_map is None:
+        return query.offset(skip).limit(limit).all()
+    rows = query.limit(skip + limit).all()
+    return sorted(rows, key=lambda row: row.id)[skip:skip + limit]
 
 
-def get_user(db: Session, user_id: int) -> models.User | None:
+def get_user(
+    db: Session, user_id: int, fields: list[str] | None = None
+) -> models.User | None:
     """Get a single user by ID"""
     try:
-        return db.query(models.User).filter(models.User.id == user_id).first()
+        return (
+            db.query(models.User)
+            .options(*_column_options(models.User, fields))
+            .filter(models.User.id == user_id)
+            .first()
+        )
     except SQLAlchemyError as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> list[models.User]:
+def get_users(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    fields: list[str] | None = None,
+    after_id: int | None = None,
+) -> list[models.User]:
     """Get list of users with pagination"""
     try:
-        return db.query(models.User).offset(skip).limit(limit).all()
+        query = db.query(models.User).options(*_column_options(models.User, fields))
+        return _paginate(query, models.User, skip, limit, after_id)
     except (OperationalError, SQLAlchemyError) as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         # Try to create tables and retry
         ensure_tables_exist()
         return []
@@ -41,14 +82,19 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
         # Ensure tables exist before writing
         ensure_tables_exist()
         
-        db_user = models.User(name=user.name, age=user.age)
+        user_id = database.allocate_id("users")
+        events.lock_outbox(db, user_id)
+        db_user = models.User(id=user_id, name=user.name, age=user.age)
         db.add(db_user)
+        db.flush()
+        events.record_user_event(db, "created", db_user)
         db.commit()
         db.refresh(db_user)
+        user_index.add(db_user.id)
         return db_user
     except (OperationalError, SQLAlchemyError) as e:
         db.rollback()
-        print(f"Database error during create: {e}")
+        logger.error("Database error during create: %s", e)
         raise
 
 
@@ -60,6 +106,7 @@ def update_user(
     """Update an existing user"""
     try:
         ensure_tables_exist()
+        events.lock_outbox(db, user_id)
         
         db_user = get_user(db, user_id)
         if not db_user:
@@ -68,13 +115,14 @@ def update_user(
         update_data = user_update.model_dump(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_user, field, value)
+        events.record_user_event(db, "updated", db_user)
         
         db.commit()
         db.refresh(db_user)
         return db_user
     except (OperationalError, SQLAlchemyError) as e:
         db.rollback()
-        print(f"Database error during update: {e}")
+        logger.error("Database error during update: %s", e)
         raise
 
 
@@ -82,36 +130,62 @@ def delete_user(db: Session, user_id: int) -> bool:
     """Delete a user"""
     try:
         ensure_tables_exist()
+        events.lock_outbox(db, user_id)
         
-        db_user = get_user(db, user_id)
+        # every item goes into a change event, so load them (description
+        # included) in one query rather than one per item
+        db_user = (
+            db.query(models.User)
+            .options(selectinload(models.User.items).undefer(models.Item.description))
+            .filter(models.User.id == user_id)
+            .first()
+        )
         if not db_user:
             return False
         
+        for db_item in db_user.items:
+            events.record_item_event(db, "deleted", db_item)
+        events.record_user_event(db, "deleted", db_user)
         db.delete(db_user)
         db.commit()
+        user_index.discard(user_id)
         return True
     except (OperationalError, SQLAlchemyError) as e:
         db.rollback()
-        print(f"Database error during delete: {e}")
+        logger.error("Database error during delete: %s", e)
         raise
 
 
 # ---- Item CRUD operations ----
-def get_item(db: Session, item_id: int) -> models.Item | None:
+def get_item(
+    db: Session, item_id: int, fields: list[str] | None = None
+) -> models.Item | None:
     """Get a single item by ID"""
     try:
-        return db.query(models.Item).filter(models.Item.id == item_id).first()
+        return (
+            db.query(models.Item)
+            .options(*_column_options(models.Item, fields))
+            .filter(models.Item.id == item_id)
+            .first()
+        )
     except SQLAlchemyError as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         raise
 
 
-def get_items(db: Session, skip: int = 0, limit: int = 100) -> list[models.Item]:
+def get_items(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    fields: list[str] | None = None,
+    after_id: int | None = None,
+) -> list[models.Item]:
     """Get list of items with pagination"""
     try:
-        return db.query(models.Item).offset(skip).limit(limit).all()
+        query = db.query(models.Item).options(*_column_options(models.Item, fields))
+        return _paginate(query, models.Item, skip, limit, after_id)
     except (OperationalError, SQLAlchemyError) as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         ensure_tables_exist()
         return []
 
@@ -120,7 +194,10 @@ def create_item(db: Session, item: schemas.ItemCreate) -> models.Item:
     """Create a new item"""
     try:
         ensure_tables_exist()
+        item_id = database.allocate_id("items", shard_key=item.owner_id)
+        events.lock_outbox(db, item.owner_id)
         db_item = models.Item(
+            id=item_id,
             title=item.title,
             description=item.description,
             price=item.price,
@@ -128,12 +205,14 @@ def create_item(db: Session, item: schemas.ItemCreate) -> models.Item:
             owner_id=item.owner_id,
         )
         db.add(db_item)
+        db.flush()
+        events.record_item_event(db, "created", db_item)
         db.commit()
         db.refresh(db_item)
         return db_item
     except (OperationalError, SQLAlchemyError) as e:
         db.rollback()
-        print(f"Database error during create_item: {e}")
+        logger.error("Database error during create_item: %s", e)
         raise
 
 
@@ -141,13 +220,16 @@ def delete_item(db: Session, item_id: int) -> bool:
     """Delete an item"""
     try:
         ensure_tables_exist()
+        # item ids route to their owner's shard
+        events.lock_outbox(db, item_id)
         db_item = get_item(db, item_id)
         if not db_item:
             return False
+        events.record_item_event(db, "deleted", db_item)
         db.delete(db_item)
         db.commit()
         return True
     except (OperationalError, SQLAlchemyError) as e:
         db.rollback()
-        print(f"Database error during delete_item: {e}")
+        logger.error("Database error during delete_item: %s", e)
         raise
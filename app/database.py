@@ -3,10 +3,16 @@ Database configuration and session management
 """
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from app.log import get_logger
+from app.sharding import ShardMap
+
+logger = get_logger(__name__)
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,32 +25,83 @@ DATABASE_URL = os.getenv(
 # PostgreSQL (use after whitelisting IP in Aiven):
 # Set DATABASE_URL in .env file with actual credentials
 
-# Configure engine based on database type
-if DATABASE_URL.startswith("sqlite"):
-    # SQLite configuration
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        echo=False
-    )
-    print("✓ Using SQLite database (local file)")
-else:
+# Connection-level Postgres statement timeout; also the cap for request deadlines
+STATEMENT_TIMEOUT_MS = 30000
+
+# Optional horizontal sharding: comma-separated URLs, one per shard
+DATABASE_SHARD_URLS = [
+    url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()
+]
+
+
+def create_db_engine(url: str) -> Engine:
+    """Configure engine based on database type"""
+    if url.startswith("sqlite"):
+        # SQLite configuration
+        sqlite_engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            echo=False
+        )
+
+        # SQLite leaves foreign keys unchecked unless asked per connection
+        @event.listens_for(sqlite_engine, "connect")
+        def _enable_foreign_keys(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+        return sqlite_engine
     # PostgreSQL configuration
-    engine = create_engine(
-        DATABASE_URL,
+    return create_engine(
+        url,
         connect_args={
             "connect_timeout": 10,
-            "options": "-c statement_timeout=30000"
+            "options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
         },
         pool_size=5,
         max_overflow=10,
         pool_pre_ping=True,
         echo=False
     )
-    print("✓ Using PostgreSQL database")
 
-# Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if DATABASE_SHARD_URLS:
+    shard_map: ShardMap | None = ShardMap([create_db_engine(url) for url in DATABASE_SHARD_URLS])
+    # first shard serves unsharded statements (health checks, migrations)
+    engine = shard_map.engines[0]
+    SessionLocal = shard_map.session_factory(autocommit=False, autoflush=False)
+    logger.info("Using %d database shards (%s)", len(shard_map), shard_map.strategy)
+else:
+    shard_map = None
+    engine = create_db_engine(DATABASE_URL)
+    # Session factory
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if DATABASE_URL.startswith("sqlite"):
+        logger.info("Using SQLite database (local file)")
+    else:
+        logger.info("Using PostgreSQL database")
+
+
+def get_shard_engines() -> list[Engine]:
+    """Engines of every shard (just the main engine when sharding is off)"""
+    return shard_map.engines if shard_map is not None else [engine]
+
+
+def shard_for(key: int | None) -> int:
+    """Shard index for a user id (or item id); 0 when sharding is off"""
+    if shard_map is None or key is None:
+        return 0
+    return shard_map.shard_for(key)
+
+
+def allocate_id(name: str, shard_key: int | None = None) -> int | None:
+    """
+    Globally unique id for a new row in sharded mode, placed on the shard of
+    `shard_key` (or the next shard in turn); None lets the database assign it
+    """
+    if shard_map is None:
+        return None
+    shard = None if shard_key is None else shard_map.shard_for(shard_key)
+    return shard_map.allocate_id(name, shard)
 
 # Base class for models
 Base = declarative_base()
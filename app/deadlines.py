@@ -0,0 +1,184 @@
+"""
+Per-request deadlines applied to database work
+
+Each request gets a deadline from the X-Request-Timeout header (milliseconds)
+or the route's default. Every transaction runs with the remaining time as its
+statement timeout, and in-flight queries are cancelled when the client
+disconnects so pooled connections are released quickly.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from app.database import STATEMENT_TIMEOUT_MS
+
+# Used for routes without their own default
+DEFAULT_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "30000"))
+# Upper bound for any deadline; SET LOCAL replaces the connection's own
+# statement timeout, so a deadline may never exceed it
+MAX_DEADLINE_MS = min(
+    int(os.getenv("MAX_REQUEST_DEADLINE_MS", str(STATEMENT_TIMEOUT_MS))),
+    STATEMENT_TIMEOUT_MS,
+)
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Postgres SQLSTATE for a statement cancelled by timeout or cancel request
+QUERY_CANCELED = "57014"
+
+# "exceeded": ran out of time, "cancelled": client went away
+deadline_stats: Counter[str] = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(outcome: str) -> None:
+    with _stats_lock:
+        deadline_stats[outcome] += 1
+
+
+class DeadlineExceeded(HTTPException):
+    """Database work stopped because the request ran out of time"""
+
+    def __init__(self, cancelled: bool = False) -> None:
+        super().__init__(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Request cancelled" if cancelled else "Request deadline exceeded",
+        )
+        self.cancelled = cancelled
+
+
+class Deadline:
+    """Time budget of one request and the DBAPI connections working for it"""
+
+    def __init__(self, timeout_ms: int) -> None:
+        self.timeout_ms = timeout_ms
+        self.expires_at = time.monotonic() + timeout_ms / 1000
+        self.cancelled = False
+        self.closed = False
+        self._connections: set[Any] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def stopped(self) -> bool:
+        return self.cancelled or self.expired
+
+    def remaining_ms(self) -> int:
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+
+    def check(self) -> None:
+        if self.stopped:
+            raise self.exceeded()
+
+    def exceeded(self) -> DeadlineExceeded:
+        _count("cancelled" if self.cancelled else "exceeded")
+        return DeadlineExceeded(cancelled=self.cancelled)
+
+    def attach(self, dbapi_connection: Any) -> None:
+        with self._lock:
+            self._connections.add(dbapi_connection)
+
+    def detach(self, dbapi_connection: Any) -> None:
+        with self._lock:
+            self._connections.discard(dbapi_connection)
+
+    def cancel(self) -> None:
+        """Abort in-flight queries (called from the event loop on disconnect)"""
+        with self._lock:
+            if self.closed:
+                return
+            self.cancelled = True
+            # abort under the lock: a connection cannot be detached and handed
+            # to another request while its cancel is being sent
+            for dbapi_connection in self._connections:
+                # psycopg2 sends a cancel request; sqlite3 interrupts the statement
+                abort = getattr(dbapi_connection, "cancel", None) or getattr(dbapi_connection, "interrupt", None)
+                if abort is not None:
+                    try:
+                        abort()
+                    except Exception:
+                        pass
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+
+
+def route_deadline(timeout_ms: int) -> Callable:
+    """Decorator setting a route's default deadline"""
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.deadline_ms = timeout_ms
+        return endpoint
+    return decorator
+
+
+def resolve_timeout_ms(header_value: str | None, endpoint: Callable | None) -> int:
+    """
+    Deadline for a request: client header, else route default, else global
+    default; never above MAX_DEADLINE_MS
+    """
+    if header_value is not None:
+        try:
+            timeout_ms = int(header_value)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{DEADLINE_HEADER} must be an integer number of milliseconds"
+            )
+        if timeout_ms <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{DEADLINE_HEADER} must be positive"
+            )
+        return min(timeout_ms, MAX_DEADLINE_MS)
+    return min(getattr(endpoint, "deadline_ms", DEFAULT_DEADLINE_MS), MAX_DEADLINE_MS)
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_deadline(session: Session, transaction, connection) -> None:
+    deadline: Deadline | None = session.info.get("deadline")
+    if deadline is None:
+        return
+    deadline.check()
+    dbapi_connection = connection.connection.driver_connection
+    connection.info["deadline"] = deadline
+    deadline.attach(dbapi_connection)
+    if connection.dialect.name == "postgresql":
+        # SET LOCAL lasts until this transaction ends
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, deadline.remaining_ms())}")
+    elif connection.dialect.name == "sqlite":
+        # SQLite has no statement timeout; poll the deadline while it executes
+        dbapi_connection.set_progress_handler(lambda: deadline.stopped, 10000)
+
+
+@event.listens_for(Pool, "checkin")
+def _release_deadline(dbapi_connection, connection_record) -> None:
+    deadline: Deadline | None = connection_record.info.pop("deadline", None)
+    if deadline is None:
+        return
+    deadline.detach(dbapi_connection)
+    if hasattr(dbapi_connection, "set_progress_handler"):
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+@event.listens_for(Engine, "handle_error")
+def _translate_deadline_errors(context) -> Exception | None:
+    connection = context.connection
+    deadline: Deadline | None = connection.info.get("deadline") if connection is not None else None
+    if deadline is None:
+        return None
+    pgcode = getattr(context.original_exception, "pgcode", None)
+    if deadline.stopped or pgcode == QUERY_CANCELED:
+        return deadline.exceeded()
+    return None
@@ -1,18 +1,81 @@
 """
 Dependency injection functions
 """
-from typing import Generator
+import asyncio
+from typing import AsyncGenerator, Callable, Generator
+from fastapi import Depends, HTTPException, Query, Request, status
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
+from app.deadlines import DEADLINE_HEADER, Deadline, resolve_timeout_ms
 
 
-def get_db() -> Generator[Session, None, None]:
+async def _cancel_on_disconnect(request: Request, deadline: Deadline) -> None:
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            deadline.cancel()
+            return
+
+
+async def get_deadline(request: Request) -> AsyncGenerator[Deadline, None]:
+    """
+    Request deadline dependency
+    Cancels the request's database work if the client disconnects.
+    Must be function-scoped: once the response is sent the server reports a
+    disconnect, which is not a cancellation.
+    """
+    deadline = Deadline(resolve_timeout_ms(
+        request.headers.get(DEADLINE_HEADER),
+        request.scope.get("endpoint"),
+    ))
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, deadline))
+    try:
+        yield deadline
+    finally:
+        deadline.close()
+        watcher.cancel()
+
+
+def get_db(
+    deadline: Deadline = Depends(get_deadline, scope="function"),
+) -> Generator[Session, None, None]:
     """
     Database session dependency
-    Yields a database session and ensures it's closed after use
+    Yields a database session and ensures it's closed after use.
+    Routes declare it with scope="function" so the session and deadline
+    are released when the endpoint returns, before the response is sent.
     """
     db = SessionLocal()
+    db.info["deadline"] = deadline
     try:
         yield db
     finally:
         db.close()
+
+
+def field_selector(schema: type[BaseModel]) -> Callable[..., list[str] | None]:
+    """
+    Build a dependency parsing a comma-separated ?fields= parameter
+    and validating each name against the response schema
+    """
+    allowed = list(schema.model_fields)
+
+    def parse_fields(
+        fields: str | None = Query(
+            None,
+            description=f"Comma-separated subset of: {', '.join(allowed)}",
+        ),
+    ) -> list[str] | None:
+        if not fields:
+            return None
+        selected = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+        unknown = [f for f in selected if f not in allowed]
+        if unknown or not selected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields selected"
+            )
+        return selected
+
+    return parse_fields
@@ -0,0 +1,413 @@
+"""
+Change feed: outbox recording and fan-out to stream subscribers
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import database, models, schemas
+from app.database import SessionLocal
+from app.log import get_logger
+from app.sharding import UnknownShardKey
+
+logger = get_logger(__name__)
+
+# Postgres NOTIFY channel used to wake dispatchers in every worker process
+CHANNEL = "change_events"
+
+# Transaction-level advisory lock key serializing outbox writers
+OUTBOX_LOCK = 0x6368616E6765  # "change"
+
+# How often the dispatcher re-reads the outbox when no notification arrives
+POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "1.0"))
+
+# Longest pause between attempts to reopen lost LISTEN connections
+LISTEN_RETRY_MAX = 30.0
+
+# Rows fetched per outbox query and per-subscriber queue size
+BATCH_SIZE = 500
+QUEUE_SIZE = 1000
+
+
+def _uses_notify(shard_engine: Engine) -> bool:
+    return shard_engine.dialect.name == "postgresql"
+
+
+def lock_outbox(db: Session, shard_key: int | None) -> None:
+    """
+    Take the outbox lock on the shard of `shard_key` for the rest of the
+    transaction. Outbox ids are taken at flush but become visible at commit;
+    holding the lock until commit makes ids commit in order, so the
+    dispatcher can never move its cursor past an id still in flight.
+    Writers call this before their first flush, so every write acquires its
+    locks in the same order. SQLite needs no lock: it has a single writer.
+    """
+    try:
+        shard = database.shard_for(shard_key)
+    except UnknownShardKey:
+        # nothing can be written for an id no shard holds
+        return
+    if not _uses_notify(database.get_shard_engines()[shard]):
+        return
+    transaction, locked = db.info.get("outbox_locks", (None, set()))
+    if transaction is not None and transaction is db.get_transaction() and shard in locked:
+        return
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(:lock)"),
+        {"lock": OUTBOX_LOCK},
+        bind_arguments={"shard_id": shard},
+    )
+    if transaction is not db.get_transaction():
+        locked = set()
+    db.info["outbox_locks"] = (db.get_transaction(), locked | {shard})
+
+
+def record_event(
+    db: Session,
+    entity: str,
+    action: str,
+    entity_id: int,
+    owner_id: int | None,
+    data: dict[str, Any],
+) -> None:
+    """
+    Add an outbox row to the current transaction (committed by the caller).
+    In sharded mode the row lands on the owner's shard next to the change.
+    """
+    # normally taken already by the caller, before its first flush
+    lock_outbox(db, owner_id)
+    shard = database.shard_for(owner_id)
+    if _uses_notify(database.get_shard_engines()[shard]):
+        # delivered by Postgres only when the transaction commits
+        db.execute(
+            text("SELECT pg_notify(:channel, '')"),
+            {"channel": CHANNEL},
+            bind_arguments={"shard_id": shard},
+        )
+    db.add(models.ChangeEvent(
+        entity=entity,
+        entity_id=entity_id,
+        action=action,
+        owner_id=owner_id,
+        payload=json.dumps(data),
+    ))
+    db.info["has_events"] = True
+
+
+def record_user_event(db: Session, action: str, user: models.User) -> None:
+    data = schemas.UserResponse.model_validate(user).model_dump(mode="json")
+    record_event(db, "user", action, user.id, user.id, data)
+
+
+def record_item_event(db: Session, action: str, item: models.Item) -> None:
+    data = schemas.ItemResponse.model_validate(item).model_dump(mode="json")
+    record_event(db, "item", action, item.id, item.owner_id, data)
+
+
+def shard_count() -> int:
+    return len(database.get_shard_engines())
+
+
+def split_event_id(event_id: int) -> tuple[int, int]:
+    """Split a global event id into (shard, outbox row id)"""
+    return event_id % shard_count(), event_id // shard_count()
+
+
+def parse_cursor(token: str | None) -> list[int] | None:
+    """
+    Parse a resume token: the last seen outbox row id per shard, joined by dots.
+    A single number applies to every shard. Raises ValueError when malformed.
+    """
+    if token is None:
+        return None
+    positions = [int(part) for part in token.split(".")]
+    if len(positions) == 1:
+        positions = positions * shard_count()
+    if len(positions) != shard_count() or min(positions) < 0:
+        raise ValueError(f"Invalid event offset: {token}")
+    return positions
+
+
+def format_cursor(positions: list[int]) -> str:
+    return ".".join(str(position) for position in positions)
+
+
+def serialize_event(row: models.ChangeEvent, shard: int = 0) -> dict[str, Any]:
+    return {
+        # unique across shards; equals the outbox row id when sharding is off
+        "id": row.id * shard_count() + shard,
+        "entity": row.entity,
+        "action": row.action,
+        "entity_id": row.entity_id,
+        "owner_id": row.owner_id,
+        "data": json.loads(row.payload),
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+def fetch_events(
+    shard: int,
+    after: int,
+    owner_id: int | None = None,
+    limit: int = BATCH_SIZE,
+) -> list[dict[str, Any]]:
+    """Read a shard's outbox rows with id greater than `after`, oldest first"""
+    if owner_id is not None:
+        try:
+            if database.shard_for(owner_id) != shard:
+                return []
+        except UnknownShardKey:
+            return []
+    db = Session(bind=database.get_shard_engines()[shard])
+    try:
+        query = db.query(models.ChangeEvent).filter(models.ChangeEvent.id > after)
+        if owner_id is not None:
+            query = query.filter(models.ChangeEvent.owner_id == owner_id)
+        rows = query.order_by(models.ChangeEvent.id).limit(limit).all()
+        return [serialize_event(row, shard) for row in rows]
+    finally:
+        db.close()
+
+
+def latest_event_ids() -> list[int]:
+    """Newest outbox row id on each shard"""
+    positions = []
+    for shard_engine in database.get_shard_engines():
+        db = Session(bind=shard_engine)
+        try:
+            positions.append(db.query(func.max(models.ChangeEvent.id)).scalar() or 0)
+        finally:
+            db.close()
+    return positions
+
+
+@dataclass(eq=False)
+class Subscription:
+    """A single stream consumer, fed from the dispatcher thread"""
+    loop: asyncio.AbstractEventLoop
+    owner_id: int | None = None
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(QUEUE_SIZE))
+    # set when the queue overflowed; the consumer re-reads the outbox to catch up
+    lagged: bool = False
+
+    def matches(self, ev: dict[str, Any]) -> bool:
+        return self.owner_id is None or ev["owner_id"] == self.owner_id
+
+    def _put(self, ev: dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(ev)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+class EventDispatcher:
+    """
+    Background thread tailing the outbox of every shard and fanning events out
+    to subscribers. Wakes on Postgres LISTEN/NOTIFY, on local commits, or
+    every POLL_INTERVAL.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: set[Subscription] = set()
+        # in-process callbacks run on the dispatcher thread for every event
+        self._listeners: list[Callable[[dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        # last dispatched outbox row id per shard
+        self.positions: list[int] = []
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            from app.crud import ensure_tables_exist
+            ensure_tables_exist()
+            self.positions = latest_event_ids()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="event-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stopping.is_set()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def subscribe(self, owner_id: int | None = None) -> Subscription:
+        self.start()
+        sub = Subscription(loop=asyncio.get_running_loop(), owner_id=owner_id)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def add_listener(self, listener: Callable[[dict[str, Any]], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _dispatch(self, shard: int) -> None:
+        while True:
+            batch = fetch_events(shard, self.positions[shard])
+            with self._lock:
+                subscribers = list(self._subscribers)
+                listeners = list(self._listeners)
+            for ev in batch:
+                for listener in listeners:
+                    try:
+                        listener(ev)
+                    except Exception as e:
+                        logger.error("Event listener error: %s", e)
+                for sub in subscribers:
+                    if not sub.matches(ev):
+                        continue
+                    try:
+                        sub.loop.call_soon_threadsafe(sub._put, ev)
+                    except RuntimeError:
+                        # event loop already closed
+                        self.unsubscribe(sub)
+                self.positions[shard] = split_event_id(ev["id"])[1]
+            if len(batch) < BATCH_SIZE:
+                return
+
+    def _run(self) -> None:
+        engines = database.get_shard_engines()
+        notify_shards = [shard for shard, shard_engine in enumerate(engines) if _uses_notify(shard_engine)]
+        # shard -> dedicated LISTEN connection; shards without one are polled
+        listeners: dict[int, Any] = {}
+        retry_at, backoff = 0.0, POLL_INTERVAL
+        try:
+            while not self._stopping.is_set():
+                if len(listeners) < len(notify_shards) and time.monotonic() >= retry_at:
+                    for shard in notify_shards:
+                        if shard not in listeners and (conn := self._listen(engines[shard])) is not None:
+                            listeners[shard] = conn
+                    if len(listeners) < len(notify_shards):
+                        retry_at, backoff = time.monotonic() + backoff, min(backoff * 2, LISTEN_RETRY_MAX)
+                for shard in range(shard_count()):
+                    try:
+                        self._dispatch(shard)
+                    except Exception as e:
+                        logger.error("Event dispatcher error: %s", e)
+                try:
+                    self._wait(list(listeners.values()))
+                    if listeners:
+                        backoff = POLL_INTERVAL
+                except Exception as e:
+                    # e.g. a server restart; poll until LISTEN is reopened
+                    logger.error("LISTEN connection lost, reconnecting: %s", e)
+                    for conn in listeners.values():
+                        self._unlisten(conn)
+                    listeners.clear()
+                    retry_at, backoff = time.monotonic() + backoff, min(backoff * 2, LISTEN_RETRY_MAX)
+        finally:
+            for conn in listeners.values():
+                self._unlisten(conn)
+
+    def _listen(self, shard_engine: Engine):
+        conn = None
+        try:
+            conn = shard_engine.raw_connection()
+            # a dedicated session: never returned to the pool in autocommit
+            # mode with LISTEN active, closed for real by _unlisten
+            conn.detach()
+            conn.driver_connection.autocommit = True
+            with conn.driver_connection.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            return conn
+        except Exception as e:
+            logger.warning("LISTEN unavailable, polling outbox instead: %s", e)
+            if conn is not None:
+                self._unlisten(conn)
+            return None
+
+    def _unlisten(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _wait(self, listeners: list) -> None:
+        if not listeners:
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+            return
+        connections = [listener.driver_connection for listener in listeners]
+        ready, _, _ = select.select(connections, [], [], POLL_INTERVAL)
+        for pg in ready:
+            pg.poll()
+            pg.notifies.clear()
+        self._wakeup.clear()
+
+
+dispatcher = EventDispatcher()
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _wake_dispatcher(session: Session) -> None:
+    if session.info.pop("has_events", False):
+        dispatcher.wake()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop("has_events", None)
+
+
+async def stream_events(
+    owner_id: int | None = None,
+    cursor: list[int] | None = None,
+) -> AsyncIterator[dict[str, Any]]:
+    """
+    Yield change events, replaying from the outbox after `cursor` first.
+    Without a cursor only events committed after subscribing are yielded.
+    Each event carries the resume token for everything up to and including it.
+    """
+    await run_in_threadpool(dispatcher.start)
+    sub = dispatcher.subscribe(owner_id)
+    try:
+        last = list(dispatcher.positions if cursor is None else cursor)
+        replay = cursor is not None
+        while True:
+            if replay or sub.lagged:
+                sub.lagged = False
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                for shard in range(len(last)):
+                    while True:
+                        batch = await run_in_threadpool(fetch_events, shard, last[shard], owner_id)
+                        for ev in batch:
+                            last[shard] = split_event_id(ev["id"])[1]
+                            yield {**ev, "cursor": format_cursor(last)}
+                        if len(batch) < BATCH_SIZE:
+                            break
+                replay = False
+            ev = await sub.queue.get()
+            shard, position = split_event_id(ev["id"])
+            if position <= last[shard]:
+                continue
+            last[shard] = position
+            yield {**ev, "cursor": format_cursor(last)}
+    finally:
+        dispatcher.unsubscribe(sub)
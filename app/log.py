@@ -0,0 +1,220 @@
+"""
+Structured, non-blocking logging
+
+Records from the `app` loggers are put on a bounded queue and written as
+JSON lines by a background thread, so request threads never block on stdout.
+Each record carries the current request id, route and elapsed time, and
+bursts of identical warnings/errors are rate-limited.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from typing import Any
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Records buffered for the writer thread; further records are dropped
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# At most LOG_RATE_LIMIT_BURST identical warnings/errors per window
+RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_SECONDS", "10"))
+RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+# ASGI scope and start time of the request being handled, if any
+_request_scope: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_scope", default=None)
+_request_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+_request_start: contextvars.ContextVar[float | None] = contextvars.ContextVar("request_start", default=None)
+
+# Attributes of a bare LogRecord; anything else was passed via `extra=`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _current_route() -> str | None:
+    """Route template (or raw path) of the request being handled"""
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+    return getattr(scope.get("route"), "path", None) or scope.get("path")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops repeats of the same warning/error beyond the burst per window.
+    Records are the same when logger, level, message template, exception
+    type and route all match: arguments (often the failing SQL and its
+    parameters) are ignored, and one failing route cannot mute another.
+    """
+
+    def __init__(self, window: float = RATE_LIMIT_WINDOW, burst: int = RATE_LIMIT_BURST) -> None:
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        # message key -> (window start, records seen in window)
+        self._seen: dict[tuple, tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        # filters run before prepare() clears exc_info
+        exc_type = record.exc_info[0] if record.exc_info else None
+        key = (record.name, record.levelno, str(record.msg), exc_type, _current_route())
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._seen.get(key, (now, 0))
+            if now - started >= self.window:
+                if count > self.burst:
+                    record.suppressed = count - self.burst
+                started, count = now, 0
+            count += 1
+            if len(self._seen) > 1000:
+                self._seen.clear()
+            self._seen[key] = (started, count)
+        return count <= self.burst
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them; only the message, exception
+    text and request context are resolved on the calling thread.
+    Records are dropped rather than blocking when the queue is full.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if _request_scope.get() is not None:
+            record.request_id = _request_id.get()
+            record.route = _current_route()
+            if not hasattr(record, "duration_ms"):
+                record.duration_ms = round((time.perf_counter() - _request_start.get()) * 1000, 2)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            ContextQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS
+        )
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def _configure() -> logging.handlers.QueueListener:
+    writer = _StdoutHandler()
+    writer.setFormatter(JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter())
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(handler)
+    app_logger.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, writer)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+_listener = _configure()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the `app` hierarchy (module __name__ is expected)"""
+    return logging.getLogger(name)
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware binding a request id to every record logged while the
+    request is handled, echoing it in the X-Request-ID response header and
+    logging one access record with the duration.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.logger = get_logger("app.access")
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        start = time.perf_counter()
+        tokens = (
+            _request_scope.set(scope),
+            _request_id.set(request_id),
+            _request_start.set(start),
+        )
+        status_code = 500
+
+        async def send_with_request_id(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [
+                    *message["headers"],
+                    (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            self.logger.info(
+                "request completed",
+                extra={
+                    "method": scope["method"],
+                    "status": status_code,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                },
+            )
+            for var, token in zip((_request_scope, _request_id, _request_start), tokens):
+                var.reset(token)
@@ -6,9 +6,14 @@ from fastapi import FastAPI, Depends
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
-from app.database import Base, engine, get_db
+from app.database import Base, allocate_id, get_db, get_shard_engines
 from app.routers import users, items
-from app import models
+from app import events, models, pricing
+from app.deadlines import deadline_stats
+from app.log import RequestContextMiddleware, get_logger
+from app.user_index import user_index
+
+logger = get_logger(__name__)
 
 
 @asynccontextmanager
@@ -28,43 +33,74 @@ async def lifespan(app: FastAPI):
         signal.alarm(15)
         
         try:
-            Base.metadata.create_all(bind=engine)
+            for shard_engine in get_shard_engines():
+                Base.metadata.create_all(bind=shard_engine)
             signal.alarm(0)  # Cancel alarm
-            print("✓ Database tables created")
+            logger.info("Database tables created")
             
             # Try to add sample data
             from app.database import SessionLocal
             db = SessionLocal()
             try:
-                if db.query(models.User).count() == 0:
+                if db.query(models.User.id).first() is None:
                     sample_users = [
-                        models.User(name="Alice", age=25),
-                        models.User(name="Bob", age=30),
-                        models.User(name="Charlie", age=35),
-                        models.User(name="Shawon", age=35),
-                        models.User(name="Sabber", age=37),
+                        models.User(id=allocate_id("users"), name=name, age=age)
+                        for name, age in [
+                            ("Alice", 25),
+                            ("Bob", 30),
+                            ("Charlie", 35),
+                            ("Shawon", 35),
+                            ("Sabber", 37),
+                        ]
                     ]
                     db.add_all(sample_users)
                     db.commit()
-                    print("✓ Sample data added")
+                    logger.info("Sample data added")
+                if user_index.mode != "off":
+                    # follow users created or deleted by other workers; the
+                    # dispatcher starts before the build so no change falls
+                    # between the two
+                    events.dispatcher.add_listener(user_index.apply_event)
+                    user_index.following = events.dispatcher.is_running
+                    events.dispatcher.start()
+                    user_index.build(db)
+                    logger.info("User index built (%s)", user_index.mode)
             finally:
                 db.close()
-            print("✓ Database initialized successfully")
+            logger.info("Database initialized successfully")
         except TimeoutError:
             signal.alarm(0)  # Cancel alarm
-            print("⚠ Database initialization timed out (Aiven server not responding)")
-            print("  → Tables will be created on first request")
+            logger.warning(
+                "Database initialization timed out (Aiven server not responding); "
+                "tables will be created on first request"
+            )
         except (OperationalError, ProgrammingError) as e:
             signal.alarm(0)  # Cancel alarm
-            print(f"⚠ Database error: {str(e)[:100]}")
-            print("  → Continuing without database initialization")
+            logger.warning(
+                "Database error, continuing without database initialization: %s", str(e)[:100]
+            )
             
     except Exception as e:
-        print(f"⚠ Unexpected error during startup: {type(e).__name__}: {str(e)[:100]}")
-        print("  → App will continue running")
+        logger.warning(
+            "Unexpected error during startup, app will continue running: %s: %s",
+            type(e).__name__, str(e)[:100]
+        )
+
+    try:
+        pricing.price_model.load()
+        logger.info("Price model loaded")
+    except FileNotFoundError:
+        logger.warning(
+            "No price model at %s; run train_price_model.py to enable price suggestions",
+            pricing.MODEL_PATH
+        )
+    except Exception as e:
+        logger.warning("Could not load price model: %s: %s", type(e).__name__, str(e)[:100])
     
     yield
 
+    events.dispatcher.stop()
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -75,6 +111,9 @@ app = FastAPI(
 )
 
 
+app.add_middleware(RequestContextMiddleware)
+
+
 # Include routers
 app.include_router(users.router)
 app.include_router(items.router)
@@ -90,3 +129,12 @@ def test_db(db: Session = Depends(get_db)) -> dict[str, str]:
     # ডাটাবেস থেকে একটি সিম্পল কোয়েরি চালানো
     result = db.execute(text("SELECT version();")).scalar_one_or_none()
     return {"postgresql_version": result or "unknown"}
+
+
+@app.get("/stats/deadlines", tags=["root"])
+def read_deadline_stats() -> dict[str, int]:
+    """Requests stopped by their deadline, kept apart from other errors"""
+    return {
+        "exceeded": deadline_stats["exceeded"],
+        "cancelled": deadline_stats["cancelled"],
+    }
@@ -1,8 +1,8 @@
 """
 SQLAlchemy database models
 """
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Text, DateTime, func
+from sqlalchemy.orm import relationship, deferred
 from app.database import Base
 
 
@@ -27,7 +27,8 @@ class Item(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), nullable=False, index=True)
-    description = Column(String(1000), nullable=True)
+    # large and rarely needed by list consumers; loaded only on request
+    description = deferred(Column(String(1000), nullable=True))
     price = Column(Float, nullable=False, default=0.0)
     is_active = Column(Boolean, nullable=False, default=True)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -36,3 +37,19 @@ class Item(Base):
 
     def __repr__(self):
         return f"<Item(id={self.id}, title={self.title}, owner_id={self.owner_id})>"
+
+
+class ChangeEvent(Base):
+    """Outbox row recording a user/item change, written in the same transaction"""
+    __tablename__ = "change_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String(20), nullable=False)
+    owner_id = Column(Integer, nullable=True, index=True)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"<ChangeEvent(id={self.id}, {self.entity}.{self.action}, entity_id={self.entity_id})>"
@@ -0,0 +1,124 @@
+"""
+Price suggestions from a model trained on existing items
+
+The model is a hashing vectorizer followed by a linear regressor, so its
+state is plain numpy arrays. It is loaded with mmap_mode="r", letting every
+worker process share the same memory pages.
+"""
+import os
+import threading
+from typing import Any
+
+import joblib
+import numpy as np
+
+# Location of the model written by train_price_model.py
+MODEL_PATH = os.getenv("PRICE_MODEL_PATH", "models/price_model.joblib")
+
+# Micro-batching: how long the first request waits for others, and the batch cap
+BATCH_WINDOW_MS = float(os.getenv("PRICE_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.getenv("PRICE_MAX_BATCH_SIZE", "256"))
+
+
+def item_text(title: str, description: str | None) -> str:
+    """Model input for an item"""
+    return f"{title}\n{description or ''}"
+
+
+def build_model() -> Any:
+    """Untrained price model (scikit-learn is only needed for training)"""
+    from sklearn.compose import TransformedTargetRegressor
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import Ridge
+    from sklearn.pipeline import make_pipeline
+
+    return TransformedTargetRegressor(
+        regressor=make_pipeline(
+            HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False),
+            Ridge(alpha=1.0),
+        ),
+        # prices are skewed; fit on log scale
+        func=np.log1p,
+        inverse_func=np.expm1,
+    )
+
+
+def train_model(texts: list[str], prices: list[float]) -> Any:
+    model = build_model()
+    model.fit(texts, np.asarray(prices, dtype=float))
+    return model
+
+
+class _Slot:
+    """One caller's share of a batch"""
+
+    def __init__(self, texts: list[str]) -> None:
+        self.texts = texts
+        self.result: list[float] | None = None
+        self.error: BaseException | None = None
+        self.done = threading.Event()
+
+
+class PredictionBatcher:
+    """
+    Merges concurrent predict calls into one vectorized model call.
+    The first caller of a batch waits up to BATCH_WINDOW_MS for others to
+    join (or until MAX_BATCH_SIZE texts are queued), then predicts for all.
+    """
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = MAX_BATCH_SIZE) -> None:
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.model: Any = None
+        self._pending: list[_Slot] = []
+        self._pending_size = 0
+        self._leader = False
+        self._full = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self, path: str = MODEL_PATH) -> None:
+        self.model = joblib.load(path, mmap_mode="r")
+
+    def predict(self, texts: list[str]) -> list[float]:
+        slot = _Slot(texts)
+        with self._lock:
+            self._pending.append(slot)
+            self._pending_size += len(texts)
+            lead = not self._leader
+            self._leader = True
+            if self._pending_size >= self.max_batch_size:
+                self._full.set()
+        if lead:
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._pending_size = 0
+                self._leader = False
+                self._full.clear()
+            self._run(batch)
+        slot.done.wait()
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def _run(self, batch: list[_Slot]) -> None:
+        try:
+            texts = [text for slot in batch for text in slot.texts]
+            prices = np.clip(self.model.predict(texts), 0, None).round(2).tolist()
+            start = 0
+            for slot in batch:
+                slot.result = prices[start:start + len(slot.texts)]
+                start += len(slot.texts)
+        except BaseException as e:
+            for slot in batch:
+                slot.error = e
+        finally:
+            for slot in batch:
+                slot.done.set()
+
+
+price_model = PredictionBatcher()
@@ -1,12 +1,23 @@
 """
 Item routes
 """
+import asyncio
+import json
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+import anyio
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from app import crud, schemas
-from app.dependencies import get_db
+from app import crud, events, pricing, schemas
+from app.deadlines import route_deadline
+from app.dependencies import field_selector, get_db
+from app.log import get_logger
+from app.sharding import UnknownShardKey
+from app.user_index import user_index
+
+logger = get_logger(__name__)
 
 router = APIRouter(
     prefix="/items",
@@ -14,62 +25,187 @@ router = APIRouter(
 )
 
 
+select_item_fields = field_selector(schema=schemas.ItemSparseResponse)
+
+
 @router.get("/", response_model=List[schemas.ItemResponse])
+@route_deadline(5000)
 def list_items(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after_id: int | None = None,
+    fields: list[str] | None = Depends(select_item_fields),
+    db: Session = Depends(get_db, scope="function")
 ):
     try:
-        return crud.get_items(db, skip=skip, limit=limit)
-    except Exception as e:
+        items = crud.get_items(db, skip=skip, limit=limit, fields=fields, after_id=after_id)
+        if fields is not None:
+            # sparse fieldsets bypass the full response model
+            return JSONResponse([schemas.pick_fields(item, fields, schemas.ItemSparseResponse) for item in items])
+        return items
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
+        )
+
+
+@router.post("/price-suggestions", response_model=List[schemas.PriceSuggestion])
+def suggest_prices(
+    payloads: List[schemas.PriceSuggestionRequest] = Body(..., min_length=1, max_length=1000),
+):
+    """Suggest prices for a batch of items from their title and description"""
+    if not pricing.price_model.loaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Price model not loaded"
+        )
+    prices = pricing.price_model.predict(
+        [pricing.item_text(p.title, p.description) for p in payloads]
+    )
+    return [
+        schemas.PriceSuggestion(title=p.title, suggested_price=price)
+        for p, price in zip(payloads, prices)
+    ]
+
+
+@router.get("/stream")
+async def stream_changes(
+    owner_id: int | None = None,
+    offset: str | None = None,
+    last_event_id: str | None = Header(None),
+):
+    """Server-sent events feed of user and item changes"""
+    try:
+        cursor = events.parse_cursor(offset if offset is not None else last_event_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid event offset"
         )
 
+    async def body():
+        changes = events.stream_events(owner_id=owner_id, cursor=cursor)
+        pending = asyncio.ensure_future(anext(changes))
+        try:
+            while True:
+                done, _ = await asyncio.wait({pending}, timeout=15)
+                if not done:
+                    # keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                ev = pending.result()
+                pending = asyncio.ensure_future(anext(changes))
+                yield f"id: {ev['cursor']}\nevent: {ev['entity']}.{ev['action']}\ndata: {json.dumps(ev)}\n\n"
+        finally:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+            await changes.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def changes_websocket(
+    websocket: WebSocket,
+    owner_id: int | None = None,
+    offset: str | None = None,
+):
+    """WebSocket feed of user and item changes"""
+    try:
+        cursor = events.parse_cursor(offset)
+    except ValueError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid event offset")
+        return
+    await websocket.accept()
+    changes = events.stream_events(owner_id=owner_id, cursor=cursor)
+
+    try:
+        async with anyio.create_task_group() as tg:
+            async def forward():
+                try:
+                    async for ev in changes:
+                        await websocket.send_json(ev)
+                except WebSocketDisconnect:
+                    pass
+                tg.cancel_scope.cancel()
+
+            async def wait_disconnect():
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        tg.cancel_scope.cancel()
+                        return
+
+            tg.start_soon(forward)
+            tg.start_soon(wait_disconnect)
+    finally:
+        await changes.aclose()
+
 
 @router.get("/{item_id}", response_model=schemas.ItemResponse)
-def get_item(item_id: int, db: Session = Depends(get_db)):
+@route_deadline(2000)
+def get_item(
+    item_id: int,
+    fields: list[str] | None = Depends(select_item_fields),
+    db: Session = Depends(get_db, scope="function")
+):
     try:
-        item = crud.get_item(db, item_id)
+        item = crud.get_item(db, item_id, fields=fields)
         if not item:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Item with id {item_id} not found"
             )
+        if fields is not None:
+            return JSONResponse(schemas.pick_fields(item, fields, schemas.ItemSparseResponse))
         return item
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.post("/", response_model=schemas.ItemResponse, status_code=status.HTTP_201_CREATED)
-def create_item(item: schemas.ItemCreate, db: Session = Depends(get_db)):
+@route_deadline(10000)
+def create_item(item: schemas.ItemCreate, db: Session = Depends(get_db, scope="function")):
+    owner_missing = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Owner with id {item.owner_id} does not exist"
+    )
     try:
-        # verify owner exists
-        owner = crud.get_user(db, item.owner_id)
-        if not owner:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Owner with id {item.owner_id} does not exist"
-            )
+        # owners the index can vouch are missing are rejected without a
+        # query; the foreign key decides everything else
+        if not user_index.might_exist(item.owner_id):
+            raise owner_missing
         return crud.create_item(db, item)
     except HTTPException:
         raise
-    except Exception as e:
+    except (IntegrityError, UnknownShardKey):
+        # UnknownShardKey: no shard can hold an owner with this id
+        raise owner_missing
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.delete("/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_item(item_id: int, db: Session = Depends(get_db)):
+@route_deadline(10000)
+def delete_item(item_id: int, db: Session = Depends(get_db, scope="function")):
     try:
         if not crud.delete_item(db, item_id):
             raise HTTPException(
@@ -78,8 +214,9 @@ def delete_item(item_id: int, db: Session = Depends(get_db)):
             )
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
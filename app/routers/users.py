@@ -3,10 +3,15 @@ User routes
 """
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from app import crud, schemas
-from app.dependencies import get_db
+from app.deadlines import route_deadline
+from app.dependencies import field_selector, get_db
+from app.log import get_logger
+
+logger = get_logger(__name__)
 
 router = APIRouter(
     prefix="/users",
@@ -14,60 +19,85 @@ router = APIRouter(
 )
 
 
+select_user_fields = field_selector(schema=schemas.UserSparseResponse)
+
+
 @router.get("/", response_model=List[schemas.UserResponse])
+@route_deadline(5000)
 def get_all_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    after_id: int | None = None,
+    fields: list[str] | None = Depends(select_user_fields),
+    db: Session = Depends(get_db, scope="function")
 ):
     """Get all users with pagination"""
     try:
-        users = crud.get_users(db, skip=skip, limit=limit)
+        users = crud.get_users(db, skip=skip, limit=limit, fields=fields, after_id=after_id)
+        if fields is not None:
+            # sparse fieldsets bypass the full response model
+            return JSONResponse([schemas.pick_fields(user, fields, schemas.UserSparseResponse) for user in users])
         return users
-    except Exception as e:
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.get("/{user_id}", response_model=schemas.UserResponse)
-def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
+@route_deadline(2000)
+def get_user_by_id(
+    user_id: int,
+    fields: list[str] | None = Depends(select_user_fields),
+    db: Session = Depends(get_db, scope="function")
+):
     """Get a specific user by ID"""
     try:
-        user = crud.get_user(db, user_id)
+        user = crud.get_user(db, user_id, fields=fields)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User with id {user_id} not found"
             )
+        if fields is not None:
+            return JSONResponse(schemas.pick_fields(user, fields, schemas.UserSparseResponse))
         return user
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.post("/", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+@route_deadline(10000)
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_db, scope="function")):
     """Create a new user"""
     try:
         return crud.create_user(db, user)
-    except Exception as e:
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.put("/{user_id}", response_model=schemas.UserResponse)
+@route_deadline(10000)
 def update_user(
     user_id: int,
     user_update: schemas.UserUpdate,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db, scope="function")
 ):
     """Update an existing user"""
     try:
@@ -80,15 +110,17 @@ def update_user(
         return user
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
+@route_deadline(10000)
+def delete_user(user_id: int, db: Session = Depends(get_db, scope="function")):
     """Delete a user"""
     try:
         if not crud.delete_user(db, user_id):
@@ -98,9 +130,10 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
             )
     except HTTPException:
         raise
-    except Exception as e:
+    except Exception:
+        logger.exception("Request failed")
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Database error: {str(e)}"
+            detail="Database unavailable"
         )
  
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 Pydantic schemas for request/response validation
 """
+from typing import Any
 from pydantic import BaseModel, ConfigDict, Field
 
 
@@ -28,6 +29,15 @@ class UserResponse(UserBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class UserSparseResponse(BaseModel):
+    """User response limited to the fields selected with ?fields="""
+    id: int | None = None
+    name: str | None = None
+    age: int | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 # Item schemas
 class ItemBase(BaseModel):
     title: str = Field(..., min_length=1, max_length=200)
@@ -45,3 +55,32 @@ class ItemResponse(ItemBase):
     id: int
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class ItemSparseResponse(BaseModel):
+    """Item response limited to the fields selected with ?fields="""
+    id: int | None = None
+    title: str | None = None
+    description: str | None = None
+    price: float | None = None
+    is_active: bool | None = None
+    owner_id: int | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class PriceSuggestionRequest(BaseModel):
+    """Item details used to suggest a price"""
+    title: str = Field(..., min_length=1, max_length=200)
+    description: str | None = Field(None, max_length=1000)
+
+
+class PriceSuggestion(BaseModel):
+    title: str
+    suggested_price: float
+
+
+def pick_fields(obj: Any, fields: list[str], schema: type[BaseModel]) -> dict[str, Any]:
+    """JSON-ready dict of an ORM object's selected fields, validated by a sparse schema"""
+    selected = schema.model_validate({field: getattr(obj, field) for field in fields})
+    return selected.model_dump(mode="json", exclude_unset=True)
@@ -0,0 +1,239 @@
+"""
+Horizontal sharding of users and items across several databases
+
+Users are partitioned by id; each user's items (and change events) live on
+the owner's shard. Ids are allocated per shard in a way that encodes the
+shard, so any user or item id can be routed without a lookup table.
+"""
+import itertools
+import os
+import threading
+from typing import Any, Iterable, Mapping
+
+from dotenv import load_dotenv
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Mapper, ORMExecuteState, sessionmaker
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BindParameter, ColumnClause
+
+load_dotenv()
+
+# "hash": id modulo shard count; "range": consecutive blocks of SHARD_RANGE_SIZE ids
+STRATEGY = os.getenv("SHARD_STRATEGY", "hash")
+RANGE_SIZE = int(os.getenv("SHARD_RANGE_SIZE", "100000000"))
+
+# Ids reserved from a shard's allocator per round trip
+ID_BLOCK_SIZE = int(os.getenv("SHARD_ID_BLOCK_SIZE", "100"))
+
+# Column whose value decides the shard of a new row, per table
+NEW_ROW_KEYS = {
+    "users": "id",
+    "items": "owner_id",
+    "change_events": "owner_id",
+}
+
+# Columns that pin a query to one shard when compared for equality
+ROUTING_COLUMNS = {
+    ("users", "id"),
+    ("items", "id"),
+    ("items", "owner_id"),
+    ("change_events", "owner_id"),
+}
+
+allocator_metadata = MetaData()
+
+id_allocations = Table(
+    "id_allocations",
+    allocator_metadata,
+    Column("name", String(50), primary_key=True),
+    Column("next_value", Integer, nullable=False),
+)
+
+
+def _equality_comparisons(statement: Any, params: Any = None) -> list[tuple[ColumnClause, Any]]:
+    """
+    Collect `column == value` pairs from a statement's WHERE clause;
+    `column IN (values)` yields one pair per value. Values of binds without
+    one of their own are taken from the execution parameters.
+    """
+    comparisons = []
+    params = params if isinstance(params, Mapping) else {}
+
+    def bound_value(bind: BindParameter) -> Any:
+        value = bind.effective_value
+        return params.get(bind.key) if value is None else value
+
+    def visit_binary(binary):
+        left, right = binary.left, binary.right
+        if binary.operator is operators.in_op:
+            if isinstance(left, ColumnClause) and isinstance(right, BindParameter) and right.expanding:
+                comparisons.extend((left, value) for value in bound_value(right) or ())
+            return
+        if binary.operator is not operators.eq:
+            return
+        if isinstance(left, BindParameter):
+            left, right = right, left
+        if isinstance(left, ColumnClause) and isinstance(right, BindParameter):
+            comparisons.append((left, bound_value(right)))
+
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is not None:
+        visitors.traverse(whereclause, {}, {"binary": visit_binary})
+    return comparisons
+
+
+class UnknownShardKey(ValueError):
+    """Raised for an id that no shard can hold"""
+
+
+class ShardMap:
+    """Maps global ids to shards, allocates new ids and routes sessions"""
+
+    def __init__(
+        self,
+        engines: list[Engine],
+        strategy: str = STRATEGY,
+        range_size: int = RANGE_SIZE,
+        block_size: int = ID_BLOCK_SIZE,
+    ) -> None:
+        if strategy not in ("hash", "range"):
+            raise ValueError(f"Unknown shard strategy: {strategy}")
+        if not engines:
+            raise ValueError("At least one shard is required")
+        self.engines = engines
+        self.strategy = strategy
+        self.range_size = range_size
+        self.block_size = block_size
+        self._blocks: dict[tuple[int, str], tuple[int, int]] = {}
+        self._allocator_ready: set[int] = set()
+        self._lock = threading.Lock()
+        self._next_shard = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    @property
+    def shard_ids(self) -> list[int]:
+        return list(range(len(self.engines)))
+
+    def shard_for(self, key: int) -> int:
+        """Shard holding the user (or item) with this id"""
+        if self.strategy == "hash":
+            return key % len(self.engines)
+        shard = (key - 1) // self.range_size
+        if not 0 <= shard < len(self.engines):
+            raise UnknownShardKey(f"Id {key} is outside every shard range")
+        return shard
+
+    def _routable_shard(self, key: int) -> int | None:
+        try:
+            return self.shard_for(key)
+        except UnknownShardKey:
+            return None
+
+    def global_id(self, shard: int, seq: int) -> int:
+        """Encode a shard-local sequence number as a globally unique id"""
+        if self.strategy == "hash":
+            return seq * len(self.engines) + shard
+        if seq > self.range_size:
+            raise RuntimeError(f"Shard {shard} has exhausted its id range")
+        return shard * self.range_size + seq
+
+    def allocate_id(self, name: str, shard: int | None = None) -> int:
+        """Next id for table `name`; new users are spread round-robin"""
+        if shard is None:
+            shard = next(self._next_shard) % len(self.engines)
+        with self._lock:
+            seq, end = self._blocks.get((shard, name), (0, 0))
+            if seq >= end:
+                seq, end = self._reserve_block(shard, name)
+            self._blocks[(shard, name)] = (seq + 1, end)
+        return self.global_id(shard, seq)
+
+    def _reserve_block(self, shard: int, name: str) -> tuple[int, int]:
+        engine = self.engines[shard]
+        if shard not in self._allocator_ready:
+            allocator_metadata.create_all(bind=engine)
+            self._allocator_ready.add(shard)
+
+        counter = id_allocations.c.next_value
+        for _ in range(3):
+            with engine.begin() as conn:
+                bumped = conn.execute(
+                    update(id_allocations)
+                    .where(id_allocations.c.name == name)
+                    .values(next_value=counter + self.block_size)
+                )
+                if bumped.rowcount:
+                    end = conn.execute(
+                        select(counter).where(id_allocations.c.name == name)
+                    ).scalar_one()
+                    return end - self.block_size, end
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(id_allocations).values(name=name, next_value=1 + self.block_size))
+                return 1, 1 + self.block_size
+            except IntegrityError:
+                # another process created the counter first; bump it instead
+                continue
+        raise RuntimeError(f"Could not reserve ids for {name} on shard {shard}")
+
+    # ---- ShardedSession hooks ----
+    def shard_chooser(self, mapper: Mapper, instance: Any, clause: Any = None) -> int:
+        if instance is None:
+            return 0
+        table = mapper.local_table.name
+        attr = NEW_ROW_KEYS.get(table)
+        key = getattr(instance, attr) if attr else None
+        if key is None:
+            raise ValueError(f"Cannot choose a shard for new {table} row without {attr or 'a shard key'}")
+        return self.shard_for(key)
+
+    def identity_chooser(
+        self,
+        mapper: Mapper,
+        primary_key: tuple,
+        *,
+        lazy_loaded_from: Any,
+        **kw: Any,
+    ) -> Iterable[int]:
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        if (mapper.local_table.name, "id") in ROUTING_COLUMNS:
+            shard = self._routable_shard(primary_key[0])
+            # no shard can hold an out-of-range id, so there is nothing to load
+            return [] if shard is None else [shard]
+        return self.shard_ids
+
+    def execute_chooser(self, context: ORMExecuteState) -> Iterable[int]:
+        if context.lazy_loaded_from is not None:
+            return [context.lazy_loaded_from.identity_token]
+        if context.bind_mapper is None:
+            # plain SQL such as health checks; any shard will do
+            return [0]
+        keys = [
+            value
+            for column, value in _equality_comparisons(context.statement, context.parameters)
+            if column.table is not None
+            and (column.table.name, column.name) in ROUTING_COLUMNS
+            and value is not None
+        ]
+        if not keys:
+            return self.shard_ids
+        shards = {self._routable_shard(key) for key in keys} - {None}
+        # only out-of-range keys: the query matches nothing, but ShardedSession
+        # needs at least one shard to run it on
+        return sorted(shards) if shards else [0]
+
+    def session_factory(self, **kwargs: Any) -> sessionmaker:
+        return sessionmaker(
+            class_=ShardedSession,
+            shards=dict(enumerate(self.engines)),
+            shard_chooser=self.shard_chooser,
+            identity_chooser=self.identity_chooser,
+            execute_chooser=self.execute_chooser,
+            **kwargs,
+        )
@@ -0,0 +1,176 @@
+"""
+Process-local index of existing user ids
+
+Lets item creation reject unknown owners without a database round trip.
+A hit may be stale or (for the Bloom filter) a false positive, so the
+items.owner_id foreign key stays the authoritative check.
+
+Users created by other workers reach this index through the change feed,
+so a miss can only be trusted for ids no higher than the highest id seen
+on the same shard, and only while the feed is being followed. Other misses
+are answered "maybe" and left to the foreign key. Ids allocated out of
+order (concurrent commits, or another worker's id block when sharded) can
+still be rejected until their change event arrives, which normally takes
+well under a second; use USER_INDEX=off where that matters.
+"""
+import hashlib
+import math
+import os
+import threading
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+from app import database, models
+from app.sharding import UnknownShardKey
+
+# "exact" keeps a set of ids, "bloom" a fixed-size Bloom filter, "off" disables it
+MODE = os.getenv("USER_INDEX", "exact")
+
+# Bloom filter sizing: expected number of users and target false-positive rate,
+# optionally capped at USER_INDEX_MAX_BYTES of memory
+CAPACITY = int(os.getenv("USER_INDEX_CAPACITY", "1000000"))
+FP_RATE = float(os.getenv("USER_INDEX_FP_RATE", "0.01"))
+MAX_BYTES = int(os.getenv("USER_INDEX_MAX_BYTES", "0"))
+
+
+class ExactIdSet:
+    """Set of ids; exact answers, memory grows with the number of users"""
+
+    def __init__(self) -> None:
+        self._ids: set[int] = set()
+
+    def add(self, key: int) -> None:
+        self._ids.add(key)
+
+    def discard(self, key: int) -> None:
+        self._ids.discard(key)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._ids
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter. Deleted ids cannot be removed, so they keep
+    answering "maybe" until the next rebuild.
+    """
+
+    def __init__(self, capacity: int = CAPACITY, fp_rate: float = FP_RATE, max_bytes: int = MAX_BYTES) -> None:
+        bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        if max_bytes:
+            bits = min(bits, max_bytes * 8)
+        self.size = max(bits, 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: int) -> None:
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def discard(self, key: int) -> None:
+        pass
+
+    def __contains__(self, key: int) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class UserIndex:
+    """Existence index of user ids, built at startup and updated on writes"""
+
+    def __init__(self, mode: str = MODE, following: Callable[[], bool] | None = None) -> None:
+        if mode not in ("exact", "bloom", "off"):
+            raise ValueError(f"Unknown user index mode: {mode}")
+        self.mode = mode
+        # reports whether other workers' changes are still being applied
+        self.following = following
+        self._ids: ExactIdSet | BloomFilter | None = None
+        # highest user id seen per shard; misses above it are not trusted
+        self._highest: dict[int, int] = {}
+        # changes seen while a build is reading users, replayed onto its result
+        self._pending: list[tuple[str, int]] | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ids is not None
+
+    def _new_ids(self) -> ExactIdSet | BloomFilter:
+        return BloomFilter() if self.mode == "bloom" else ExactIdSet()
+
+    def build(self, db: Session) -> None:
+        """Load every user id; until this runs every lookup answers "maybe" """
+        if self.mode == "off":
+            return
+        with self._lock:
+            self._pending = []
+        ids = self._new_ids()
+        highest: dict[int, int] = {}
+        try:
+            for (user_id,) in db.query(models.User.id).yield_per(10000):
+                ids.add(user_id)
+                self._raise_highest(highest, user_id)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for op, user_id in self._pending:
+                getattr(ids, op)(user_id)
+                self._raise_highest(highest, user_id)
+            self._ids = ids
+            self._highest = highest
+            self._pending = None
+
+    @staticmethod
+    def _raise_highest(highest: dict[int, int], user_id: int) -> None:
+        shard = database.shard_for(user_id)
+        highest[shard] = max(highest.get(shard, 0), user_id)
+
+    def _apply(self, op: str, user_id: int) -> None:
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((op, user_id))
+            if self._ids is not None:
+                getattr(self._ids, op)(user_id)
+                self._raise_highest(self._highest, user_id)
+
+    def add(self, user_id: int) -> None:
+        self._apply("add", user_id)
+
+    def discard(self, user_id: int) -> None:
+        self._apply("discard", user_id)
+
+    def might_exist(self, user_id: int) -> bool:
+        """False only when the index can vouch that the user does not exist"""
+        ids = self._ids
+        if ids is None or user_id in ids:
+            return True
+        try:
+            shard = database.shard_for(user_id)
+        except UnknownShardKey:
+            # no shard can hold this id
+            return False
+        if self.following is not None and not self.following():
+            # blind to users created elsewhere; let the foreign key decide
+            return True
+        return user_id > self._highest.get(shard, 0)
+
+    def apply_event(self, ev: dict[str, Any]) -> None:
+        """Follow user changes made by other processes via the change feed"""
+        if ev["entity"] != "user":
+            return
+        if ev["action"] == "created":
+            self.add(ev["entity_id"])
+        elif ev["action"] == "deleted":
+            self.discard(ev["entity_id"])
+
+
+user_index = UserIndex()
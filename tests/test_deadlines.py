@@ -0,0 +1,132 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import asyncio
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app import dependencies
+from app.database import SessionLocal
+from app.database import STATEMENT_TIMEOUT_MS
+from app.deadlines import Deadline, DeadlineExceeded, deadline_stats, resolve_timeout_ms
+from app.main import app
+
+client = TestClient(app)
+
+SLOW_QUERY = text(
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+    "SELECT count(*) FROM n"
+)
+
+
+def test_slow_query_is_stopped_at_deadline():
+    before = deadline_stats["exceeded"]
+    db = SessionLocal()
+    db.info["deadline"] = Deadline(timeout_ms=100)
+    started = time.monotonic()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            db.execute(SLOW_QUERY)
+    finally:
+        db.close()
+    assert time.monotonic() - started < 5
+    assert deadline_stats["exceeded"] == before + 1
+
+
+def test_cancelled_deadline_stops_new_transactions():
+    deadline = Deadline(timeout_ms=10000)
+    deadline.cancel()
+    db = SessionLocal()
+    db.info["deadline"] = deadline
+    try:
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+    assert exc_info.value.cancelled
+
+
+def test_deadline_header_validation():
+    resp = client.get("/users/", headers={"X-Request-Timeout": "soon"})
+    assert resp.status_code == 400
+
+    resp = client.get("/users/", headers={"X-Request-Timeout": "5000"})
+    assert resp.status_code == 200
+
+
+def test_deadlines_never_exceed_statement_timeout():
+    assert resolve_timeout_ms("5000", None) == 5000
+    assert resolve_timeout_ms("600000", None) <= STATEMENT_TIMEOUT_MS
+    assert resolve_timeout_ms(None, None) <= STATEMENT_TIMEOUT_MS
+
+
+@pytest.fixture
+def deadlines(monkeypatch):
+    """Every Deadline created for a request during the test"""
+    created = []
+
+    class RecordingDeadline(Deadline):
+        def __init__(self, timeout_ms):
+            super().__init__(timeout_ms)
+            created.append(self)
+
+    monkeypatch.setattr(dependencies, "Deadline", RecordingDeadline)
+    return created
+
+
+def test_completed_request_is_not_cancelled(deadlines):
+    resp = client.post("/users/", json={"name": "deadline", "age": 30})
+    assert resp.status_code == 201
+    resp = client.get("/users/")
+    assert resp.status_code == 200
+
+    assert len(deadlines) == 2
+    assert all(deadline.closed and not deadline.cancelled for deadline in deadlines)
+
+
+def test_client_disconnect_cancels_running_query(deadlines):
+    slow_app = FastAPI()
+
+    @slow_app.get("/slow")
+    def slow(db: Session = Depends(dependencies.get_db, scope="function")):
+        db.execute(SLOW_QUERY)
+
+    async def run():
+        disconnect = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if not sent:
+                sent.append(True)
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                sent.append(message["status"])
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/slow", "raw_path": b"/slow",
+            "root_path": "", "query_string": b"", "headers": [],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        task = asyncio.create_task(slow_app(scope, receive, send))
+        await asyncio.sleep(0.3)
+        disconnect.set()
+        await asyncio.wait_for(task, 5)
+        return sent[-1]
+
+    before = deadline_stats["cancelled"]
+    started = time.monotonic()
+    assert asyncio.run(run()) == 504
+    assert time.monotonic() - started < 5
+    assert deadlines[-1].cancelled
+    assert deadline_stats["cancelled"] == before + 1
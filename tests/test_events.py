@@ -0,0 +1,239 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import asyncio
+import json
+import threading
+from typing import Any
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import crud, database, events, schemas
+from app.main import app
+from app.database import SessionLocal
+from app.events import dispatcher
+
+client = TestClient(app)
+
+
+class SSEStream:
+    """
+    Drives GET /items/stream on the ASGI app directly (TestClient would wait
+    for the endless body). Events are parsed as they arrive; with `paused`
+    set, the response is stalled after its first event.
+    """
+
+    def __init__(self, path: str, headers: dict[str, str] | None = None) -> None:
+        path, _, query = path.partition("?")
+        self.scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": query.encode(),
+            "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.paused = asyncio.Event()
+        self.paused.set()
+        self._disconnect = asyncio.Event()
+        self._requested = False
+        self._buffer = ""
+        self._task: asyncio.Task | None = None
+
+    async def _receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] != "http.response.body":
+            return
+        self._buffer += message.get("body", b"").decode()
+        while "\n\n" in self._buffer:
+            block, self._buffer = self._buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if "data" in fields:
+                await self.events.put({**json.loads(fields["data"]), "sse_id": fields["id"]})
+                await self.paused.wait()
+
+    async def __aenter__(self) -> "SSEStream":
+        self._task = asyncio.create_task(app(self.scope, self._receive, self._send))
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.paused.set()
+        self._disconnect.set()
+        await asyncio.wait_for(self._task, 5)
+
+    async def next(self) -> dict[str, Any]:
+        return await asyncio.wait_for(self.events.get(), 5)
+
+
+def _write(write):
+    db = SessionLocal()
+    try:
+        return write(db)
+    finally:
+        db.close()
+
+
+def test_change_feed_replay_and_live():
+    resp = client.post("/users/", json={"name": "watcher", "age": 40})
+    assert resp.status_code == 201
+    user_id = resp.json()["id"]
+
+    payload: dict[str, Any] = {"title": "First", "price": 1.0, "owner_id": user_id}
+    resp = client.post("/items/", json=payload)
+    assert resp.status_code == 201
+    first_id = resp.json()["id"]
+
+    # other owners' changes are filtered out
+    client.post("/users/", json={"name": "someone else", "age": 20})
+
+    try:
+        with client.websocket_connect(f"/items/ws?owner_id={user_id}&offset=0") as ws:
+            ev = ws.receive_json()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("user", "created", user_id)
+            ev = ws.receive_json()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("item", "created", first_id)
+            offset = ev["id"]
+
+            client.delete(f"/items/{first_id}")
+            ev = ws.receive_json()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("item", "deleted", first_id)
+            assert ev["owner_id"] == user_id
+            assert ev["id"] > offset
+    finally:
+        dispatcher.stop()
+
+
+def test_dispatcher_survives_listen_errors(monkeypatch):
+    monkeypatch.setattr(events, "POLL_INTERVAL", 0.05)
+    feed = events.EventDispatcher()
+    seen = threading.Event()
+    feed.add_listener(lambda ev: ev["entity"] == "user" and ev["data"]["name"] == "after error" and seen.set())
+
+    wait = feed._wait
+    failures = []
+    def flaky_wait(listeners):
+        if not failures:
+            failures.append(True)
+            raise OSError("connection lost")
+        wait(listeners)
+    monkeypatch.setattr(feed, "_wait", flaky_wait)
+
+    feed.start()
+    try:
+        assert feed._thread.is_alive()
+        client.post("/users/", json={"name": "after error", "age": 33})
+        assert seen.wait(5)
+        assert failures and feed._thread.is_alive()
+    finally:
+        feed.stop()
+
+
+def test_writes_lock_the_outbox_before_any_write(tmp_path, monkeypatch):
+    engine = database.create_db_engine(f"sqlite:///{tmp_path}/outbox.db")
+
+    # stand-ins for the Postgres functions, so the statement order can be checked
+    @event.listens_for(engine, "connect")
+    def _postgres_functions(dbapi_connection, connection_record):
+        dbapi_connection.create_function("pg_advisory_xact_lock", 1, lambda key: None)
+        dbapi_connection.create_function("pg_notify", 2, lambda channel, payload: None)
+
+    statements = []
+    @event.listens_for(engine, "before_cursor_execute")
+    def _record(conn, cursor, statement, *args):
+        statements.append(statement.split()[0].upper())
+        if "pg_advisory_xact_lock" in statement:
+            statements[-1] = "LOCK"
+
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(events, "_uses_notify", lambda shard_engine: True)
+    crud.ensure_tables_exist()
+
+    def first_write_follows_lock(write):
+        statements.clear()
+        db = Session(bind=engine)
+        try:
+            result = write(db)
+        finally:
+            db.close()
+        writes = [i for i, s in enumerate(statements) if s in ("INSERT", "UPDATE", "DELETE")]
+        assert statements.count("LOCK") == 1
+        assert statements.index("LOCK") < writes[0]
+        return result
+
+    user = first_write_follows_lock(lambda db: crud.create_user(db, schemas.UserCreate(name="lock", age=30)))
+    item = first_write_follows_lock(
+        lambda db: crud.create_item(db, schemas.ItemCreate(title="lock", price=1.0, owner_id=user.id))
+    )
+    first_write_follows_lock(lambda db: crud.update_user(db, user.id, schemas.UserUpdate(age=31)))
+    first_write_follows_lock(lambda db: crud.delete_item(db, item.id))
+    first_write_follows_lock(lambda db: crud.delete_user(db, user.id))
+    engine.dispose()
+
+
+def test_sse_replay_resume_and_live():
+    user = _write(lambda db: crud.create_user(db, schemas.UserCreate(name="sse", age=40)))
+    item = _write(lambda db: crud.create_item(db, schemas.ItemCreate(title="sse", price=1.0, owner_id=user.id)))
+
+    async def run():
+        async with SSEStream(f"/items/stream?owner_id={user.id}&offset=0") as stream:
+            ev = await stream.next()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("user", "created", user.id)
+            resume = ev["sse_id"]
+            ev = await stream.next()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("item", "created", item.id)
+
+            _write(lambda db: crud.delete_item(db, item.id))
+            ev = await stream.next()
+            assert (ev["entity"], ev["action"], ev["entity_id"]) == ("item", "deleted", item.id)
+
+        # reconnecting with Last-Event-ID resumes right after that event
+        async with SSEStream(f"/items/stream?owner_id={user.id}", {"Last-Event-ID": resume}) as stream:
+            assert [(await stream.next())["action"] for _ in range(2)] == ["created", "deleted"]
+
+    try:
+        asyncio.run(run())
+    finally:
+        dispatcher.stop()
+
+
+def test_sse_rejects_malformed_offset():
+    assert client.get("/items/stream?offset=abc").status_code == 400
+    assert client.get("/items/stream", headers={"Last-Event-ID": "-1"}).status_code == 400
+
+
+def test_sse_lagging_subscriber_catches_up_from_outbox(monkeypatch):
+    monkeypatch.setattr(events, "QUEUE_SIZE", 2)
+    user = _write(lambda db: crud.create_user(db, schemas.UserCreate(name="slow reader", age=40)))
+
+    async def run():
+        async with SSEStream(f"/items/stream?owner_id={user.id}&offset=0") as stream:
+            # stall the response after the first event so the queue overflows
+            stream.paused.clear()
+            assert (await stream.next())["entity"] == "user"
+            items = [
+                _write(lambda db: crud.create_item(db, schemas.ItemCreate(title=f"i{i}", price=i, owner_id=user.id)))
+                for i in range(5)
+            ]
+            latest = events.latest_event_ids()[0]
+            while dispatcher.positions[0] < latest:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            readers = [sub for sub in dispatcher._subscribers if sub.owner_id == user.id]
+            assert readers and all(sub.lagged for sub in readers)
+
+            stream.paused.set()
+            received = [(await stream.next())["entity_id"] for _ in items]
+            assert received == [item.id for item in items]
+            assert stream.events.empty()
+
+    try:
+        asyncio.run(run())
+    finally:
+        dispatcher.stop()
@@ -11,12 +11,104 @@ if os.path.exists("./test.db"):
         pass
 
 from typing import Any
+import pytest
 from fastapi.testclient import TestClient
+from app import crud
 from app.main import app
+from app.database import SessionLocal
+from app.routers import items
+from app.user_index import UserIndex
 
 client = TestClient(app)
 
 
+def test_sparse_fieldsets():
+    resp = client.post("/users/", json={"name": "sparse", "age": 22})
+    assert resp.status_code == 201
+    user_id = resp.json()["id"]
+
+    payload: dict[str, Any] = {
+        "title": "Sparse Item",
+        "description": "x" * 500,
+        "price": 3.5,
+        "owner_id": user_id,
+    }
+    resp = client.post("/items/", json=payload)
+    assert resp.status_code == 201
+    item_id = resp.json()["id"]
+
+    # full representation by default, including the deferred description
+    resp = client.get(f"/items/{item_id}")
+    assert resp.status_code == 200
+    assert resp.json()["description"] == "x" * 500
+
+    resp = client.get(f"/items/{item_id}?fields=id,title,price")
+    assert resp.status_code == 200
+    assert resp.json() == {"id": item_id, "title": "Sparse Item", "price": 3.5}
+
+    resp = client.get("/items/?fields=id,owner_id")
+    assert resp.status_code == 200
+    assert {"id": item_id, "owner_id": user_id} in resp.json()
+
+    resp = client.get(f"/users/{user_id}?fields=name")
+    assert resp.json() == {"name": "sparse"}
+
+    resp = client.get("/items/?fields=id,secret")
+    assert resp.status_code == 400
+
+    # the documented model stays the full one; sparse output is opt-in
+    spec = client.get("/openapi.json").json()
+    detail = spec["paths"]["/items/{item_id}"]["get"]["responses"]["200"]
+    assert detail["content"]["application/json"]["schema"]["$ref"].endswith("/ItemResponse")
+
+
+@pytest.fixture
+def user_index(monkeypatch):
+    """A fresh, unbuilt index in place of the app's for the duration of a test"""
+    index = UserIndex("exact")
+    monkeypatch.setattr(crud, "user_index", index)
+    monkeypatch.setattr(items, "user_index", index)
+    return index
+
+
+def test_create_item_rejects_unknown_owner(user_index):
+    payload: dict[str, Any] = {"title": "Orphan", "price": 1.0, "owner_id": 999999}
+
+    # without a built index the foreign key rejects the insert
+    resp = client.post("/items/", json=payload)
+    assert resp.status_code == 400
+
+    resp = client.post("/users/", json={"name": "deleted", "age": 50})
+    deleted_id = resp.json()["id"]
+    client.post("/users/", json={"name": "kept", "age": 50})
+    client.delete(f"/users/{deleted_id}")
+    db = SessionLocal()
+    try:
+        user_index.build(db)
+    finally:
+        db.close()
+
+    # a miss below the highest known id is definite: no query needed
+    assert not user_index.might_exist(deleted_id)
+    resp = client.post("/items/", json={**payload, "owner_id": deleted_id})
+    assert resp.status_code == 400
+
+    # ids the index has not seen may belong to another worker's new user
+    assert user_index.might_exist(999999)
+    resp = client.post("/items/", json=payload)
+    assert resp.status_code == 400
+
+    resp = client.post("/users/", json={"name": "indexed", "age": 50})
+    user_id = resp.json()["id"]
+    assert user_index.might_exist(user_id)
+    resp = client.post("/items/", json={**payload, "owner_id": user_id})
+    assert resp.status_code == 201
+
+    # while the change feed is down, no miss is trusted
+    user_index.following = lambda: False
+    assert user_index.might_exist(deleted_id)
+
+
 def test_item_crud_flow():
     # create a user first
     resp = client.post("/users/", json={"name": "tester", "age": 30})
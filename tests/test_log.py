@@ -0,0 +1,77 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import json
+import logging
+
+from fastapi.testclient import TestClient
+
+from app.log import ContextQueueHandler, JsonFormatter, RateLimitFilter, _request_scope
+from app.main import app
+
+client = TestClient(app)
+
+
+def _record(msg, *args, level=logging.ERROR, exc_info=None):
+    return logging.LogRecord("app.test", level, __file__, 1, msg, args, exc_info)
+
+
+def test_rate_limit_drops_repeated_errors():
+    limiter = RateLimitFilter(window=60, burst=2)
+    # the arguments (e.g. SQL with bound parameters) differ on every failure
+    allowed = [limiter.filter(_record("Database error: %s", f"SELECT ... id={i}")) for i in range(5)]
+    assert allowed == [True, True, False, False, False]
+
+    # different messages and lower levels are not affected
+    assert limiter.filter(_record("Database error during create: %s", "down"))
+    assert all(limiter.filter(_record("hello", level=logging.INFO)) for _ in range(5))
+
+
+def test_rate_limit_keys_on_exception_type_and_route():
+    limiter = RateLimitFilter(window=60, burst=1)
+    for exc in (ValueError("a"), KeyError("b")):
+        assert limiter.filter(_record("Request failed", exc_info=(type(exc), exc, None)))
+    assert not limiter.filter(_record("Request failed", exc_info=(KeyError, KeyError("c"), None)))
+
+    for path in ("/items/", "/users/"):
+        token = _request_scope.set({"path": path})
+        try:
+            assert limiter.filter(_record("Request failed"))
+        finally:
+            _request_scope.reset(token)
+
+
+def test_suppressed_count_reported_after_window():
+    limiter = RateLimitFilter(window=0, burst=1)
+    limiter.filter(_record("boom"))
+    record = _record("boom")
+    assert limiter.filter(record)
+    assert not hasattr(record, "suppressed")
+
+    limiter = RateLimitFilter(window=60, burst=1)
+    for _ in range(4):
+        limiter.filter(_record("boom"))
+    limiter.window = 0
+    record = _record("boom")
+    assert limiter.filter(record)
+    assert record.suppressed == 3
+
+
+def test_json_lines_carry_message_and_extras():
+    handler = ContextQueueHandler(None)
+    record = handler.prepare(_record("Database error: %s", "down"))
+    record.duration_ms = 1.5
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "app.test"
+    assert entry["message"] == "Database error: down"
+    assert entry["duration_ms"] == 1.5
+
+
+def test_request_id_header():
+    resp = client.get("/", headers={"X-Request-ID": "abc123"})
+    assert resp.headers["x-request-id"] == "abc123"
+
+    resp = client.get("/")
+    assert len(resp.headers["x-request-id"]) == 32
@@ -0,0 +1,71 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import threading
+
+import joblib
+from fastapi.testclient import TestClient
+
+from app import pricing
+from app.main import app
+
+client = TestClient(app)
+
+
+def _train(path):
+    texts = [pricing.item_text(f"cheap pen {i}", "plastic") for i in range(20)]
+    texts += [pricing.item_text(f"gold watch {i}", "luxury") for i in range(20)]
+    prices = [2.0] * 20 + [900.0] * 20
+    joblib.dump(pricing.train_model(texts, prices), path)
+
+
+def test_price_suggestions(tmp_path):
+    pricing.price_model.model = None
+    resp = client.post("/items/price-suggestions", json=[{"title": "pen"}])
+    assert resp.status_code == 503
+
+    path = tmp_path / "price_model.joblib"
+    _train(path)
+    pricing.price_model.load(str(path))
+
+    resp = client.post("/items/price-suggestions", json=[
+        {"title": "cheap pen", "description": "plastic"},
+        {"title": "gold watch", "description": "luxury"},
+    ])
+    assert resp.status_code == 200
+    pen, watch = resp.json()
+    assert pen["title"] == "cheap pen"
+    assert 0 <= pen["suggested_price"] < watch["suggested_price"]
+
+    resp = client.post("/items/price-suggestions", json=[])
+    assert resp.status_code == 422
+
+
+def test_concurrent_requests_share_one_predict(tmp_path):
+    path = tmp_path / "price_model.joblib"
+    _train(path)
+    model = joblib.load(path)
+    calls = []
+
+    class CountingModel:
+        def predict(self, texts):
+            calls.append(len(texts))
+            return model.predict(texts)
+
+    batcher = pricing.PredictionBatcher(window_ms=200)
+    batcher.model = CountingModel()
+    results = {}
+
+    def request(i):
+        results[i] = batcher.predict([pricing.item_text(f"gold watch {i}", None)])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [5]
+    assert sorted(results) == list(range(5))
+    assert all(len(prices) == 1 for prices in results.values())
@@ -0,0 +1,118 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event, text
+
+from app import crud, database, schemas
+from app.routers import items
+from app.sharding import ShardMap, UnknownShardKey
+
+
+@pytest.fixture(params=["hash", "range"])
+def sharded_db(request, tmp_path, monkeypatch):
+    engines = [
+        database.create_db_engine(f"sqlite:///{tmp_path}/shard{i}.db") for i in range(3)
+    ]
+    shard_map = ShardMap(engines, strategy=request.param, range_size=1000, block_size=4)
+    monkeypatch.setattr(database, "shard_map", shard_map)
+    crud.ensure_tables_exist()
+    db = shard_map.session_factory(autoflush=False)()
+    try:
+        yield db, shard_map
+    finally:
+        db.close()
+        for engine in engines:
+            engine.dispose()
+
+
+def _rows_on(engine, table):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text(f"SELECT id FROM {table}"))}
+
+
+def test_users_and_items_are_colocated(sharded_db):
+    db, shard_map = sharded_db
+    users = [crud.create_user(db, schemas.UserCreate(name=f"u{i}", age=20 + i)) for i in range(7)]
+    ids = [user.id for user in users]
+    assert len(set(ids)) == len(ids)
+    # new users are spread over every shard
+    assert {shard_map.shard_for(user_id) for user_id in ids} == {0, 1, 2}
+
+    owner = users[4]
+    items = [
+        crud.create_item(db, schemas.ItemCreate(title=f"i{i}", price=i, owner_id=owner.id))
+        for i in range(3)
+    ]
+    owner_shard = shard_map.shard_for(owner.id)
+    for shard, engine in enumerate(shard_map.engines):
+        stored_users = _rows_on(engine, "users")
+        assert stored_users == {i for i in ids if shard_map.shard_for(i) == shard}
+        stored_items = _rows_on(engine, "items")
+        assert stored_items == ({item.id for item in items} if shard == owner_shard else set())
+
+    db.expunge_all()
+    assert crud.get_item(db, items[1].id).title == "i1"
+    assert crud.get_user(db, owner.id).name == "u4"
+
+    assert crud.delete_user(db, owner.id)
+    assert _rows_on(shard_map.engines[owner_shard], "items") == set()
+
+
+def test_delete_user_loads_items_in_one_query(sharded_db):
+    db, shard_map = sharded_db
+    owner = crud.create_user(db, schemas.UserCreate(name="owner", age=40))
+    owner_id = owner.id
+    for i in range(4):
+        crud.create_item(db, schemas.ItemCreate(title=f"i{i}", description="d", price=i, owner_id=owner_id))
+    db.expunge_all()
+
+    selects = []
+    def count_selects(conn, cursor, statement, *args):
+        if statement.startswith("SELECT"):
+            selects.append(statement)
+    for engine in shard_map.engines:
+        event.listen(engine, "before_cursor_execute", count_selects)
+
+    assert crud.delete_user(db, owner_id)
+    # the user, then all of its items from the owner's shard only
+    assert len(selects) == 2
+
+
+def test_list_merges_shards_in_id_order(sharded_db):
+    db, _ = sharded_db
+    ids = sorted(crud.create_user(db, schemas.UserCreate(name=f"u{i}", age=30)).id for i in range(8))
+
+    assert [user.id for user in crud.get_users(db, limit=5)] == ids[:5]
+    assert [user.id for user in crud.get_users(db, skip=2, limit=3)] == ids[2:5]
+
+    # keyset pagination walks every user exactly once
+    seen, after_id = [], None
+    while page := crud.get_users(db, limit=3, after_id=after_id):
+        seen.extend(user.id for user in page)
+        after_id = page[-1].id
+    assert seen == ids
+
+
+def test_unroutable_ids_are_not_found(sharded_db):
+    db, shard_map = sharded_db
+    user = crud.create_user(db, schemas.UserCreate(name="routable", age=40))
+    db.expunge_all()
+
+    # 0 and 5000 fall outside every range with three shards of 1000 ids
+    for user_id in (0, 5000):
+        assert crud.get_user(db, user_id) is None
+        assert db.get(type(user), user_id) is None
+        assert not crud.delete_user(db, user_id)
+    assert crud.get_user(db, user.id).name == "routable"
+
+    item = schemas.ItemCreate(title="orphan", price=1.0, owner_id=5000)
+    if shard_map.strategy == "range":
+        with pytest.raises(UnknownShardKey):
+            crud.create_item(db, item)
+    with pytest.raises(HTTPException) as exc_info:
+        items.create_item(item, db)
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Owner with id 5000 does not exist"
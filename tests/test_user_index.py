@@ -0,0 +1,47 @@
+import os
+
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+from app.user_index import BloomFilter, ExactIdSet, UserIndex
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, fp_rate=0.01)
+    for key in range(0, 3000, 3):
+        bloom.add(key)
+    assert all(key in bloom for key in range(0, 3000, 3))
+
+    false_positives = sum(key in bloom for key in range(1, 30000, 3))
+    assert false_positives < 10000 * 0.05
+
+
+def test_bloom_filter_memory_cap():
+    bloom = BloomFilter(capacity=1_000_000, fp_rate=0.001, max_bytes=1024)
+    assert bloom.size == 1024 * 8
+
+
+def test_exact_set_forgets_deleted_ids():
+    ids = ExactIdSet()
+    ids.add(7)
+    assert 7 in ids
+    ids.discard(7)
+    assert 7 not in ids
+
+
+def test_build_keeps_changes_made_while_loading():
+    index = UserIndex("exact")
+
+    class Query:
+        def yield_per(self, count):
+            # another worker's changes arrive while the ids are being read
+            index.add(2)
+            index.discard(1)
+            return iter([(1,)])
+
+    class Db:
+        def query(self, column):
+            return Query()
+
+    index.build(Db())
+    assert index.might_exist(2)
+    assert not index.might_exist(1)
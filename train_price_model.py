@@ -0,0 +1,43 @@
+"""
+Train the price suggestion model from the items table
+Usage: python train_price_model.py [output path]
+"""
+import os
+import sys
+
+import joblib
+from dotenv import load_dotenv
+
+from app import models, pricing
+from app.database import SessionLocal
+
+# Load environment variables
+load_dotenv()
+
+output_path = sys.argv[1] if len(sys.argv) > 1 else pricing.MODEL_PATH
+
+print("🔧 Loading items...")
+db = SessionLocal()
+try:
+    rows = (
+        db.query(models.Item.title, models.Item.description, models.Item.price)
+        .filter(models.Item.price > 0)
+        .all()
+    )
+finally:
+    db.close()
+
+if len(rows) < 2:
+    print(f"❌ Need at least 2 priced items to train, found {len(rows)}")
+    exit(1)
+
+print(f"✨ Training on {len(rows)} items...")
+model = pricing.train_model(
+    [pricing.item_text(title, description) for title, description, _ in rows],
+    [price for _, _, price in rows],
+)
+
+os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+# uncompressed so the arrays can be memory-mapped at load time
+joblib.dump(model, output_path)
+print(f"✅ Model saved to {output_path}")